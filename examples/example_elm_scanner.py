@@ -3,6 +3,7 @@ import logging
 import os
 import sys
 import json
+import time
 
 sys.path.append(f'{os.getcwd()}')
 
@@ -68,6 +69,8 @@ def main():
         if app.is_connected:
             print(f'Vehicle bus protocol: {app.elm.protocol}')
             app.start()
+            while True:
+                time.sleep(1)
     except Exception as err:
         logger.exception(err)
         app.stop()
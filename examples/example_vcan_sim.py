@@ -1,6 +1,7 @@
 import logging
 import os
 import sys
+import time
 
 sys.path.append(f'{os.getcwd()}')
 
@@ -30,6 +31,8 @@ def main():
     vin = app.query(pid=2, mode=9)
     print(f'VIN = {vin.value}')
     app.start()
+    while True:
+        time.sleep(1)
 
 
 if __name__ == '__main__':
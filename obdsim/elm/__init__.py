@@ -1 +1 @@
-from .elm import Elm327, ElmProtocol, ElmStatus
\ No newline at end of file
+from .elm import MAX_PIDS_PER_QUERY, Elm327, ElmProtocol, ElmStatus
@@ -8,11 +8,33 @@ from socket import socket as Socket
 import serial
 
 AUTO_BAUD = [38400, 9600]
+MAX_PIDS_PER_QUERY = 6
+# ELM327 status lines reported instead of vehicle data
+ELM_ERRORS = (
+    '?',
+    'BUFFER FULL',
+    'BUS BUSY',
+    'BUS ERROR',
+    'CAN ERROR',
+    'DATA ERROR',
+    'FB ERROR',
+    'LV RESET',
+    'STOPPED',
+)
 
 _log = logging.getLogger(__name__)
 TEST_MODE = True
 
 
+def _raise_for_elm_error(res: 'list[str]'):
+    """Raises `ConnectionError` if a response has no data or an ELM error."""
+    if not res:
+        raise ConnectionError('No response from ELM')
+    for line in res:
+        if line in ELM_ERRORS or line.startswith(('ERR', '<RX ERROR')):
+            raise ConnectionError(f'ELM reported {line}')
+
+
 class ElmStatus(IntEnum):
     NOT_CONNECTED = 0
     ELM_CONNECTED = 1
@@ -172,7 +194,7 @@ class Elm327:
             
         """
         if not data.startswith('AT'):
-            _log.debug(f'Transmitting on OBD2: {data}')
+            _log.debug('Transmitting on OBD2: %s', data)
         self.flush()
         to_send = f'{data}{self.TERMINATOR}'.encode('utf-8')
         if isinstance(self._connection, Socket):
@@ -192,7 +214,7 @@ class Elm327:
             except (socket.timeout, TimeoutError):
                 time.sleep(0.1)
         recv_time = time.time()
-        _log.debug(f'{data} round-trip: {round(recv_time - send_time)} seconds')
+        _log.debug('%s round-trip: %.3f seconds', data, recv_time - send_time)
         received = read.decode('utf-8', 'backslashreplace')
         response = [r.strip() for r in received.split('\r') if r.strip()]
         if response[0] == data:
@@ -352,8 +374,9 @@ class Elm327:
         if 'UNABLE TO CONNECT' in res:
             _log.warning('Unable to connect')
             raise ConnectionError('Vehicle is not connected')
+        _raise_for_elm_error(res)
         header_id, payload = res[0].split(' ', 1)
-        _log.debug(f'Response received from ECU ID {header_id}')
+        _log.debug('Response received from ECU ID %s', header_id)
         data_hex = payload.replace(' ', '')
         obd2_length = int(data_hex[:2], 16)
         obd2_payload_length = len(data_hex[2:]) / 2
@@ -369,3 +392,62 @@ class Elm327:
             return bytes.fromhex(data_hex)
         else:
             raise NotImplementedError
+    
+    def query_pids(self, pids: 'list[int]', mode: int = 1) -> bytes:
+        """Gets the values of multiple PIDs in a single request.
+        
+        Multi-frame (ISO 15765-2) responses are reassembled. If more than one
+        ECU responds only the first is used.
+        
+        Args:
+            pids: Up to `MAX_PIDS_PER_QUERY` PID numbers (0..255)
+            mode: The Mode/service (0..9), defaults to Mode 1
+        
+        Returns:
+            The response payload starting with the response mode byte
+            e.g. `41 0C 1A F8 0D 32`
+        
+        Raises:
+            `ConnectionError` if no vehicle connection is present.
+            
+        """
+        if not self.status == ElmStatus.CAR_CONNECTED:
+            raise ConnectionError('Vehicle is not connected')
+        if mode not in range(0,2):
+            raise ValueError(f'Unsupported Mode: {mode}')
+        if not 0 < len(pids) <= MAX_PIDS_PER_QUERY:
+            raise ValueError(f'Must query 1 to {MAX_PIDS_PER_QUERY} PIDs')
+        if any(pid not in range(0,256) for pid in pids):
+            raise ValueError(f'Invalid PID in: {pids}')
+        res = self.get_response(f'{mode:02x}' +
+                                ''.join(f'{pid:02x}' for pid in pids))
+        if 'NO DATA' in res:
+            raise ConnectionError('ELM timeout indicates NO DATA')
+        if 'SEARCHING...' in res:
+            res.remove('SEARCHING...')
+        if 'UNABLE TO CONNECT' in res:
+            _log.warning('Unable to connect')
+            raise ConnectionError('Vehicle is not connected')
+        _raise_for_elm_error(res)
+        frames: 'dict[str, list[bytes]]' = {}
+        for line in res:
+            header_id, payload = line.split(' ', 1)
+            frames.setdefault(header_id, []).append(
+                bytes.fromhex(payload.replace(' ', '')))
+        header_id, parts = next(iter(frames.items()))
+        if len(frames) > 1:
+            _log.debug('Using response from ECU ID %s of %s',
+                       header_id, list(frames))
+        first = parts[0]
+        if first[0] >> 4 == 0:
+            return first[1:1 + first[0]]
+        if first[0] >> 4 != 1:
+            raise ValueError(f'Unexpected frame type: {first.hex()}')
+        length = ((first[0] & 0x0F) << 8) | first[1]
+        payload = bytearray(first[2:])
+        for part in parts[1:]:
+            payload.extend(part[1:])
+        if len(payload) < length:
+            _log.warning(f'Expected {length} bytes'
+                         f' but received {len(payload)}')
+        return bytes(payload[:length])
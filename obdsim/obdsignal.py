@@ -18,10 +18,31 @@ ureg.define('ppm = count / 1000000 = PPM = parts_per_million')
 Q_ = ureg.Quantity
 
 
+def pids_from_bitmask(mask: int, base: int) -> 'list[int]':
+    """Gets the PIDs set in a supported PIDs bitmask.
+    
+    Iterates only the set bits, lowest first.
+    
+    Args:
+        mask: The 32-bit bitmask value.
+        base: The reference PID of the bitmask.
+    
+    Returns:
+        A sorted list of PIDs where bit n represents PID `base + n + 1`.
+        
+    """
+    supported = []
+    while mask:
+        lsb = mask & -mask
+        supported.append(base + lsb.bit_length())
+        mask ^= lsb
+    return supported
+
+
 def decode_pids_supported(mode: int,
                           pid: int,
                           value: int,
-                          previous: dict = {},
+                          previous: 'dict|None' = None,
                           ) -> 'dict[int, list]':
     """Decodes the PIDs supported bitmask to dictionary of PID lists.
     
@@ -38,16 +59,11 @@ def decode_pids_supported(mode: int,
         A dictionary formatted as `{ mode: [<pids>] }
         
     """
-    supported = []
-    bitmask_str = f'{value:032b}'
-    for i, bit in enumerate(reversed(bitmask_str)):
-        if bit == '1':
-            supported.append(pid + i + 1)
-    supported.sort()
-    if previous:
-        if mode not in previous:
-            previous[mode] = []
-        previous[mode] = [p for p in supported if p not in previous[mode]].sort()
+    supported = pids_from_bitmask(value, pid)
+    if previous is not None:
+        merged = set(previous.get(mode, ()))
+        merged.update(supported)
+        previous[mode] = sorted(merged)
         return previous
     return { mode: supported }
     
@@ -82,13 +98,7 @@ class ObdSupportedPids:
     
     @property
     def pids(self) -> 'list[int]':
-        supported = []
-        bitmask_str = f'{self.value:032b}'
-        for i, bit in enumerate(reversed(bitmask_str)):
-            if bit == '1':
-                supported.append(self.pid + i + 1)
-        supported.sort()
-        return supported
+        return pids_from_bitmask(self.value, self.pid)
     
     @pids.setter
     def pids(self, pid_list: 'list[int]'):
@@ -100,6 +110,36 @@ class ObdSupportedPids:
         for p in list(set(pid_list)):
             bitmask = bitmask | 1 << (p - self.pid - 1)
         self.value = bitmask
+    
+    @classmethod
+    def decode_many(cls,
+                    pids: 'list[int]',
+                    values: 'list[int]',
+                    ) -> 'list[list[int]]':
+        """Decodes a batch of supported PIDs bitmasks.
+        
+        Intended for bulk decoding e.g. replay of logged data. Live queries
+        should use the `pids` property. Requires the optional `numpy`
+        dependency, installed with the `replay` extra.
+        
+        Args:
+            pids: The reference PID of each bitmask.
+            values: The 32-bit bitmask values, same length as `pids`.
+        
+        Returns:
+            A list of supported PID lists, one per bitmask.
+        
+        """
+        import numpy as np
+        pids = np.asarray(pids, dtype=np.int64)
+        values = np.ascontiguousarray(values, dtype='<u4')
+        if pids.shape != values.shape:
+            raise ValueError('pids and values must be the same length')
+        bits = np.unpackbits(values.view(np.uint8).reshape(-1, 4),
+                             axis=1,
+                             bitorder='little')
+        return [(np.nonzero(row)[0] + pid + 1).tolist()
+                for pid, row in zip(pids, bits)]
 
 
 class ObdIgnitionType(IntEnum):
@@ -126,6 +166,10 @@ class ObdPidDefinition:
     scale: float = 1
     offset: int = 0
     unit: Any = None
+    
+    def __post_init__(self):
+        self._is_bitmask: bool = self.data_type is ObdSupportedPids
+        self._is_int: bool = self.data_type is int
 
 
 @dataclass
@@ -152,6 +196,19 @@ PID_DEFINITIONS: 'list[ObdPidDefinition]' = [
     ObdPidDefinition(0x9, 0x02, 6, 'VIN', ObdVin),
 ]
 
+# Lookup tables built once from PID_DEFINITIONS, first definition wins
+_PID_BY_NAME: 'dict[tuple[int, str], int]' = {}
+_NAME_BY_PID: 'dict[tuple[int, int], str]' = {}
+_DEF_BY_PID: 'dict[tuple[int, int], ObdPidDefinition]' = {}
+for _pid_def in PID_DEFINITIONS:
+    _PID_BY_NAME.setdefault((_pid_def.mode, _pid_def.name), _pid_def.pid)
+    _NAME_BY_PID.setdefault((_pid_def.mode, _pid_def.pid), _pid_def.name)
+    _DEF_BY_PID.setdefault((_pid_def.mode, _pid_def.pid), _pid_def)
+del _pid_def
+
+# DBC multiplexer signal name of the PID for each service/mode
+PID_MUX: 'dict[int, str]' = { mode: f'PID_S{mode:01x}' for mode in range(16) }
+
 
 class ObdSignal:
     """A class defining a simulated OBD2 signal.
@@ -162,45 +219,44 @@ class ObdSignal:
         length (int): The number of bytes used by the PID.
         value: A measurement value with units from the `pint` module.
         value_raw: The raw measurement value without units.
-        ts (float): The (unix) timestamp of the measurement.
+        ts (int): The (unix) timestamp of the measurement in nanoseconds.
         
     """
-    def __init__(self, mode: int, pid: int, value: Any, ts: float = None) -> None:
+    def __init__(self, mode: int, pid: int, value: Any, ts: int = None) -> None:
         """Creates an ObdSignal.
         
         Args:
             mode: The OBD2 service/mode number
             pid: The Parameter ID number
             value: The decoded (raw) value
-            ts: The timestamp of the decoded value
+            ts: The timestamp of the decoded value (unix nanoseconds)
             
         """
         self.mode: int = mode
         self.pid: int = pid
-        self.pid_def: ObdPidDefinition = None
-        for pid_def in PID_DEFINITIONS:
-            if pid_def.mode == mode and pid_def.pid == pid:
-                self.pid_def = pid_def
-                break
+        self.pid_def: ObdPidDefinition = _DEF_BY_PID.get((mode, pid))
         if self.pid_def is None:
             raise ValueError(f'Undefined PID {pid} (mode {mode})')
         self._data_type = None
         self._length: int = 0
         self._value = None
-        self.ts: float = ts or time.time()
+        self.ts: int = ts if ts is not None else time.time_ns()
         self.value = value
 
     @classmethod
     def get_pid_by_name(cls, name: str, mode: int = 1) -> 'int|None':
-        for pid_def in PID_DEFINITIONS:
-            if pid_def.name == name and pid_def.mode == mode:
-                return pid_def.pid
+        return _PID_BY_NAME.get((mode, name))
         
     @classmethod
     def get_name_by_pid(cls, pid: int, mode: int = 1) -> 'str|None':
-        for pid_def in PID_DEFINITIONS:
-            if pid_def.pid == pid and pid_def.mode == mode:
-                return pid_def.name
+        return _NAME_BY_PID.get((mode, pid))
+    
+    @classmethod
+    def get_definition(cls,
+                       pid: int,
+                       mode: int = 1,
+                       ) -> 'ObdPidDefinition|None':
+        return _DEF_BY_PID.get((mode, pid))
         
     @property
     def name(self) -> str:
@@ -220,15 +276,15 @@ class ObdSignal:
     
     @property
     def value(self) -> Any:
-        if self.pid_def.data_type.__name__ == 'ObdSupportedPids':
+        if self.pid_def._is_bitmask:
             return ObdSupportedPids(self.mode, self.pid, self._value).pids
-        if self.pid_def.data_type.__name__ == 'int':
+        if self.pid_def._is_int:
             return self.pid_def.offset + self.pid_def.scale * self._value
         return self._value
     
     @value.setter
     def value(self, value):
-        if self.pid_def.data_type.__name__ == 'ObdSupportedPids':
+        if self.pid_def._is_bitmask:
             if isinstance(value, int):
                 self._value = value
             elif isinstance(value, list):
@@ -239,17 +295,17 @@ class ObdSignal:
                 self._value = obj.value
             else:
                 raise ValueError(f'Unexpected data type {type(value)}')
-        elif self.pid_def.data_type.__name__ == 'int':
+        elif self.pid_def._is_int:
             self._value = int((value - self.pid_def.offset) /
                               self.pid_def.scale)
-        elif self.pid_def.data_type.__name__ == 'ObdVin':
+        elif self.pid_def.data_type is ObdVin:
             if not isinstance(value, str) or len(value) != 17:
                 raise ValueError('Invalid VIN')
         self._value = value
 
     @property
     def quantity(self) -> Any:
-        if self.pid_def.data_type.__name__ == 'int':
+        if self.pid_def._is_int:
             return Q_(self.value, self.pid_def.unit)
         return self.value
 
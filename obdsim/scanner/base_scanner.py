@@ -3,17 +3,21 @@
 """
 import logging
 import os
+import threading
 import time
 
+import can
 from cantools.database import Database as CanDatabase
 from cantools.database import Message as CanMessage
-from cantools.database import load_file as load_can_database
 
-from obdsim.obdsignal import ObdSignal
+from obdsim.obdsignal import ObdSignal, pids_from_bitmask
+from obdsim.utils.dbc import load_dbc
 
 DBC_FILE = os.getenv('DBC_FILE', './dbc/python-obd.dbc')
 DBC_REQUEST = os.getenv('DBC_REQUEST', 'OBD2_REQUEST')
 DBC_RESPONSE = os.getenv('DBC_RESPONSE', 'OBD2_ECU_RESPONSE')
+MAX_BACKOFF_INTERVAL = 30   #: Upper limit seconds between idle scans
+NEXT_RANGE_SUPPORTED = 1 << 31   #: Bitmask flag for PID + 32 supported
 
 _log = logging.getLogger(__name__)
 
@@ -29,7 +33,8 @@ class ObdScanner:
         pids_supported (dict): The PIDs supported by the vehicle, described
             as { mode: [pid, ...]} where mode and pid are integers.
         signals (dict): The decoded values of the PIDs most recently queried.
-            Described by { mode: { pid: ObdSignal }}
+            Described by { mode: { pid: ObdSignal }}, `None` until the PID
+            has responded.
         
     """
     def __init__(self,
@@ -55,13 +60,16 @@ class ObdScanner:
         """
         self.scan_interval = scan_interval
         self.scan_timeout = scan_timeout
-        self._db: CanDatabase = load_can_database(dbc_filename)
+        self._db: CanDatabase = load_dbc(dbc_filename)
         self._obd_req: CanMessage = self._db.get_message_by_name(dbc_request)
         self._obd_res: CanMessage = self._db.get_message_by_name(dbc_response)
         self._scan_pids: 'dict[list[int]]' = {}
-        # _signals as [mode][pid] = ObdSignal
-        self._signals: dict = {}
-        self._running = False
+        # _scan_plan as [(mode, pid), ...] flattened from _scan_pids by start
+        self._scan_plan: 'list[tuple[int, int]]' = []
+        # _signals as [(mode, pid)] = ObdSignal
+        self._signals: 'dict[tuple[int, int], ObdSignal]' = {}
+        self._stop_event = threading.Event()
+        self._scan_thread: threading.Thread = None
         self.vin_message_count: int = 0   #: populated by query(mode=9, pid=1)
     
     @property
@@ -72,7 +80,10 @@ class ObdScanner:
     @property
     def signals(self) -> 'dict[dict[ObdSignal]]':
         """Decoded signal values read from the vehicle."""
-        return self._signals
+        signals = { mode: {} for mode in self._scan_pids }
+        for (mode, pid), value in self._signals.items():
+            signals.setdefault(mode, {})[pid] = value
+        return signals
     
     def connect(self):
         """Connects to the vehicle OBD2 bus."""
@@ -84,25 +95,60 @@ class ObdScanner:
         raise NotImplementedError('Subclass must provide is_connected property')
     
     def start(self):
-        """Starts OBD scanning."""
+        """Starts OBD scanning in a background thread.
+        
+        Raises:
+            `RuntimeError` if scanning is already running.
+        
+        """
+        if self._scan_thread is not None and self._scan_thread.is_alive():
+            raise RuntimeError('PID scanning already running')
         _log.info('Starting PID scanning')
         self._scan_pids = { 1: [] }
-        self._signals = { 1: {} }
         self._get_pids_supported()
         if not self.pids_supported:
             raise ConnectionError('Unable to determine supported PIDs')
+        self._scan_plan = [(mode, pid)
+                           for mode, pids in self._scan_pids.items()
+                           for pid in pids]
+        self._signals = { key: None for key in self._scan_plan }
         _log.info(f'PIDs supported: {self.pids_supported}')
-        self._running = True
-        self._loop()
+        self._stop_event.clear()
+        self._scan_thread = threading.Thread(target=self._loop,
+                                             name='obd_scanner',
+                                             daemon=True)
+        self._scan_thread.start()
     
     def stop(self):
-        """Stops OBD scanning."""
-        self._running = False
+        """Stops OBD scanning.
+        
+        Waits for a scan in progress to finish so scanning can be restarted.
+        """
+        self._stop_event.set()
+        scan_thread = self._scan_thread
+        if (scan_thread is not None and
+            scan_thread is not threading.current_thread()):
+            scan_thread.join()
+        self._scan_thread = None
     
     def query(self, pid: int, mode: int = 1) -> ObdSignal:
         """Queries a specific PID with optional mode."""
         raise NotImplementedError('Subclass must provide query method.')
     
+    def query_multi(self,
+                    pids: 'list[int]',
+                    mode: int = 1,
+                    ) -> 'list[ObdSignal|None]':
+        """Queries several PIDs of the same mode.
+        
+        Subclasses may override to batch PIDs into fewer requests.
+        
+        Returns:
+            A list of signals (or None) in the same order as `pids`.
+        
+        """
+        return [self.query(pid, mode) for pid in pids]
+    
     def _get_pids_supported(self):
         """Queries the vehicle bus for supported PIDs."""
         # if not self.is_connected:
@@ -110,42 +156,78 @@ class ObdScanner:
         #     self._pids_supported = {}
         #     return
         for mode in [1]:
-            if mode not in self._scan_pids:
-                self._scan_pids[mode] = []
+            pids_supported: 'set[int]' = set(self._scan_pids.get(mode, ()))
             pid = 0
             while True:
                 response = self.query(pid, mode)
                 if (not isinstance(response, ObdSignal) or
-                    not isinstance(response.value, list)):
+                    not isinstance(response.value_raw, int)):
                     _log.warning(f'Invalid response for mode {mode} pid {pid}')
                     break
-                for supported_pid in response.value:
-                    pids_supported: 'list[int]' = self._scan_pids[mode]
-                    if not supported_pid in pids_supported:
-                        if supported_pid == pid + 32:
-                            continue
-                        pids_supported.append(supported_pid)
-                        pids_supported.sort()
-                if (pid + 32) not in response.value:
+                bitmask = response.value_raw
+                pids_supported.update(pids_from_bitmask(bitmask, pid))
+                if not bitmask & NEXT_RANGE_SUPPORTED:
                     break
+                pids_supported.discard(pid + 32)
                 pid += 32
+            self._scan_pids[mode] = sorted(pids_supported)
         _log.info(f'PIDs to scan: {self._scan_pids}')
         
     def _loop(self):
         """Loops through supported pids querying and populating signals.
         
-        Repeats at the scan_interval.
+        Repeats every scan_interval measured from the start of each scan,
+        skipping any intervals missed by a slow scan, until stopped.
+        If a scan gets no responses, or fails e.g. because the bus is down,
+        the interval backs off exponentially up to `MAX_BACKOFF_INTERVAL`
+        until a response is received.
         """
-        if self._running:
-            for mode, pids_supported in self.pids_supported.items():
-                for pid in pids_supported:
-                    signal = self.query(pid, mode)
-                    if (not isinstance(self._signals, dict) or
-                        mode not in self._signals):
-                        # create mode signals dictionary
-                        self._signals[mode] = {}
-                    self._signals[mode][pid] = signal.quantity
-                    _log.info(f'Updated [{mode}][{pid}] "{signal.name}"'
-                              f' = {self._signals[mode][pid]}')
-        time.sleep(self.scan_interval)
-        self._loop()
+        next_tick = time.monotonic()
+        backoff = 1
+        while not self._stop_event.is_set():
+            interval = self.scan_interval
+            try:
+                updated = self._scan_once()
+            except (ConnectionError, OSError, can.CanError) as err:
+                _log.error('Scan failed: %s', err)
+                updated = 0
+            except Exception:
+                _log.exception('Unexpected scan failure')
+                updated = 0
+            if updated:
+                backoff = 1
+            else:
+                interval = min(interval * backoff,
+                               max(interval, MAX_BACKOFF_INTERVAL))
+                _log.debug('No PIDs updated - next scan in %s s', interval)
+                backoff *= 2
+            next_tick += interval
+            now = time.monotonic()
+            if next_tick < now:
+                next_tick = now
+            self._stop_event.wait(timeout=next_tick - now)
+    
+    def _scan_once(self) -> int:
+        """Queries each supported PID once, updating signals.
+        
+        Returns:
+            The number of signals updated.
+        
+        """
+        updated = 0
+        for mode, pid in self._scan_plan:
+            updated += self._update_signal(mode, pid, self.query(pid, mode))
+        return updated
+    
+    def _update_signal(self,
+                       mode: int,
+                       pid: int,
+                       signal: 'ObdSignal|None',
+                       ) -> bool:
+        """Stores the latest value of a queried signal if one was received."""
+        if signal is None:
+            return False
+        self._signals[(mode, pid)] = signal.quantity
+        _log.info('Updated [%d][%d] "%s" = %s',
+                  mode, pid, signal.name, self._signals[(mode, pid)])
+        return True
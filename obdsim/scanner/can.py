@@ -1,14 +1,42 @@
 """OBD2 scanner for native CANbus (ISO 15765-4)."""
+import asyncio
+import inspect
 import logging
-import os
+import selectors
+import threading
 import time
+from concurrent.futures import FIRST_COMPLETED, Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures import wait
+from typing import Callable
 
 import can
+from can.interfaces.socketcand import SocketCanDaemonBus
+from cantools.database import DecodeError
+
+from obdsim.obdsignal import PID_MUX
 
 from .base_scanner import ObdScanner, ObdSignal
 
 _log = logging.getLogger(__name__)
 
+# ISO 15765-2 flow control: continue to send, no block size, no separation
+FLOW_CONTROL_CTS = b'\x30\x00\x00\x00\x00\x00\x00\x00'
+# ISO 15765-4 physical request ID = ECU response ID - 8 e.g. 0x7E8 -> 0x7E0
+PHYSICAL_ID_OFFSET = 8
+# ISO 15765-4 29-bit IDs 0x18DA<target><source> e.g. 0x18DAF110 -> 0x18DA10F1
+PHYSICAL_ID_29_PREFIX = 0x18DA0000
+# Response timeout adapts to a moving average of the observed round-trip time
+RTT_EWMA_GAIN = 0.125
+RTT_TIMEOUT_FACTOR = 3
+# ISO 15765-4 P2CAN: an ECU may take up to 50 ms to respond
+MIN_RESPONSE_TIMEOUT = 0.05
+# ISO-TP frames of a 17 character VIN response [49 02 01 <VIN>]
+VIN_FRAME_COUNT = 3
+# Receive errors e.g. bus down are retried with exponential backoff
+RX_ERROR_BACKOFF = 0.1
+MAX_RX_ERROR_BACKOFF = 5
+
 
 class CanScanner(ObdScanner):
     """Scans periodically on a native or virtual CANbus using ISO 15765-4.
@@ -30,11 +58,40 @@ class CanScanner(ObdScanner):
             dbc_filename (str): The filename/path of the `.dbc` reference
             dbc_msgename (str): The BO_ name of the request name in the
                 `.dbc` file.
+            socketcand (tuple): Optional (host, port) of a remote socketcand
+                server serving `bus_name`, instead of local socketcan.
+            max_in_flight (int): The number of scan requests awaiting a
+                response at once. Default `1` waits for each response per
+                ISO 15765-4. Higher values pipeline requests, which some
+                ECUs drop or reject while busy.
         
         """
+        socketcand = kwargs.pop('socketcand', None)
+        if socketcand is not None and not isinstance(socketcand, tuple):
+            raise ValueError('Invalid socketcand parameters')
+        max_in_flight = kwargs.pop('max_in_flight', 1)
+        if not isinstance(max_in_flight, int) or max_in_flight < 1:
+            raise ValueError('max_in_flight must be a positive integer')
         super().__init__(**kwargs)
+        self.max_in_flight: int = max_in_flight
         self._bus_name = bus_name
+        self._socketcand: 'tuple[str, int]|None' = socketcand
         self.bus: can.Bus = None
+        # _pending as [(mode, pid)] = Future awaiting the response ObdSignal
+        self._pending: 'dict[tuple[int, int], Future]' = {}
+        self._pending_lock = threading.Lock()
+        # _sent_at as [(mode, pid)] = monotonic time the query was sent
+        self._sent_at: 'dict[tuple[int, int], float]' = {}
+        # _rtt_ewma starts so the initial response timeout is scan_timeout
+        self._rtt_ewma: float = self.scan_timeout / RTT_TIMEOUT_FACTOR
+        self._vin_parts: 'list[bytes]' = []
+        self._vin_length: int = 0   #: ISO-TP first frame payload length
+        # _requests as [(mode, pid)] = encoded request, payload is constant
+        self._requests: 'dict[tuple[int, int], can.Message]' = {}
+        # _decoders as [(mode, pid)] = direct decoder or None to use cantools
+        self._decoders: 'dict[tuple[int, int], Callable|None]' = {}
+        self._obd_header: bool = self._has_obd_header()
+        self._rx_thread: threading.Thread = None
 
     def connect(self, bus_name: str = None):
         """Connects to the OBD2 CANbus.
@@ -51,11 +108,41 @@ class CanScanner(ObdScanner):
                 bus_name = self._bus_name
         elif not self._bus_name:
             self._bus_name = bus_name
-        sys_name = f'/sys/class/net/{bus_name}'
-        if not os.path.exists(sys_name):
-            raise FileNotFoundError(f'Cannot find {sys_name}')
-        _log.debug(f'Using CANbus {bus_name}')
-        self.bus = can.Bus(bus_name, bustype='socketcan')
+        if self._socketcand:
+            host, port = self._socketcand
+            _log.debug(f'Using CANbus {bus_name} via socketcand {host}:{port}')
+            self.bus = self._socketcand_bus(bus_name, host, port)
+        else:
+            _log.debug(f'Using CANbus {bus_name}')
+            try:
+                self.bus = can.Bus(bus_name, bustype='socketcan')
+            except (OSError, can.CanError) as exc:
+                raise FileNotFoundError(f'Cannot open CANbus {bus_name}'
+                                        ) from exc
+        self._rx_thread = threading.Thread(target=self._rx_dispatch,
+                                           name='obd_can_rx',
+                                           daemon=True)
+        self._rx_thread.start()
+    
+    @staticmethod
+    def _socketcand_bus(bus_name: str, host: str, port: int) -> can.Bus:
+        """Opens a socketcand bus tuned for request/response latency.
+        
+        Sets TCP_NODELAY and TCP_QUICKACK via python-can `tcp_tune` where
+        supported (4.3+), otherwise the connection is left untuned.
+        """
+        params = inspect.signature(SocketCanDaemonBus.__init__).parameters
+        if 'tcp_tune' not in params:
+            _log.warning('TCP tuning unavailable - requires python-can 4.3+')
+            return can.Bus(bus_name,
+                           bustype='socketcand',
+                           host=host,
+                           port=port)
+        return can.Bus(bus_name,
+                       bustype='socketcand',
+                       host=host,
+                       port=port,
+                       tcp_tune=True)
     
     @property
     def is_connected(self) -> bool:
@@ -63,66 +150,327 @@ class CanScanner(ObdScanner):
     
     def query(self, pid: int, mode: int = 1) -> 'ObdSignal|None':
         """Returns the result of an OBD2 query via CANbus."""
+        timeout = self._query_timeout(pid, mode)
+        future = self._send(pid, mode)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            self._discard(pid, mode, future)
+            _log.warning(f'No response received for mode {mode} PID {pid}')
+    
+    async def query_async(self, pid: int, mode: int = 1) -> 'ObdSignal|None':
+        """Returns the result of an OBD2 query via CANbus without blocking.
+        
+        Multiple queries may be awaited concurrently e.g. with
+        `asyncio.gather`, responses are matched to queries by mode and PID.
+        """
+        timeout = self._query_timeout(pid, mode)
+        future = self._send(pid, mode)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future),
+                                          timeout)
+        except asyncio.TimeoutError:
+            self._discard(pid, mode, future)
+            _log.warning(f'No response received for mode {mode} PID {pid}')
+    
+    def _query_timeout(self, pid: int, mode: int = 1) -> float:
+        """Gets the time to wait for a query response in seconds.
+        
+        Each attempt allows a multiple of the average round-trip time,
+        bounded by `scan_timeout`.
+        """
+        max_attempts = 3
         if mode == 9 and pid == 2:
-            if not self.vin_message_count:
-                raise ValueError('Must query mode 9 pid 1 first'
-                                 'to determine response message count')
-            vin = ''
-        pid_mux = f'PID_S{mode:01x}'   #: Simplified DBC
+            max_attempts += max(self.vin_message_count, VIN_FRAME_COUNT)
+        per_attempt = max(self._rtt_ewma * RTT_TIMEOUT_FACTOR,
+                          MIN_RESPONSE_TIMEOUT)
+        return min(per_attempt, self.scan_timeout) * max_attempts
+    
+    def _scan_once(self) -> int:
+        """Queries each supported PID once, updating signals.
+        
+        Up to `max_in_flight` requests await a response at a time, the next
+        being sent as soon as one resolves or reaches its adaptive timeout.
+        
+        Returns:
+            The number of signals updated.
+        
+        """
+        updated = 0
+        plan = iter(self._scan_plan)
+        # in_flight as {Future: (mode, pid, deadline)}
+        in_flight: 'dict[Future, tuple[int, int, float]]' = {}
+        try:
+            while True:
+                while len(in_flight) < self.max_in_flight:
+                    mode, pid = next(plan, (None, None))
+                    if mode is None:
+                        break
+                    deadline = (time.monotonic() +
+                                self._query_timeout(pid, mode))
+                    in_flight[self._send(pid, mode)] = (mode, pid, deadline)
+                if not in_flight:
+                    return updated
+                first_deadline = min(d for _, _, d in in_flight.values())
+                timeout = max(0, first_deadline - time.monotonic())
+                done, _ = wait(in_flight,
+                               timeout=timeout,
+                               return_when=FIRST_COMPLETED)
+                now = time.monotonic()
+                for future, (mode, pid, deadline) in list(in_flight.items()):
+                    if future in done:
+                        del in_flight[future]
+                        updated += self._update_signal(mode, pid,
+                                                       future.result())
+                    elif deadline <= now:
+                        del in_flight[future]
+                        self._discard(pid, mode, future)
+                        _log.warning('No response received for mode %d'
+                                     ' PID %d', mode, pid)
+        finally:
+            for future, (mode, pid, _) in in_flight.items():
+                self._discard(pid, mode, future)
+    
+    def _send(self, pid: int, mode: int = 1) -> Future:
+        """Sends a query and returns a Future for the response ObdSignal."""
+        request = self._requests.get((mode, pid))
+        if request is None:
+            request = self._build_request(pid, mode)
+            self._requests[(mode, pid)] = request
+        future = Future()
+        with self._pending_lock:
+            if mode == 9 and pid == 2:
+                self._vin_parts = []
+            self._pending[(mode, pid)] = future
+            self._sent_at[(mode, pid)] = time.monotonic()
+        try:
+            self.bus.send(request)
+        except (OSError, can.CanError):
+            self._discard(pid, mode, future)
+            raise
+        return future
+    
+    def _build_request(self, pid: int, mode: int = 1) -> can.Message:
+        """Encodes the CANbus request message for a PID."""
+        pid_mux = PID_MUX[mode]   #: Simplified DBC
         content = {
             'request': 0,
             'service': mode,
             'length': 2,
             pid_mux: pid,
         }
-        data = self._obd_req.encode(content)
-        request = can.Message(arbitration_id=self._obd_req.frame_id,
-                              is_extended_id=self._obd_req.frame_id >= 2**1,
-                              data=data)
-        response_complete = False
-        partial_responses = 0
-        response = None
-        signal = None
-        self.bus.send(request)
-        attempts = 0
-        max_attempts = 3
-        if mode == 9 and pid == 2:
-            max_attempts += self.vin_message_count
-        while not response_complete and attempts < max_attempts:
-            attempts += 1
-            response = self.bus.recv(timeout=self.scan_timeout)
-            if response:
-                response_time = time.time()
-                if mode == 9 and pid == 2:
-                    partial_responses += 1
-                    _log.debug('Parsing multi-message response'
-                               f' part {partial_responses}: {response}')
-                    vin += self._parse_vin_part(response.data,
-                                                partial_responses)
-                    if partial_responses == self.vin_message_count:
-                        response_complete = True
-                        signal = ObdSignal(mode, pid, vin, ts=response_time)
+        obd_req = self._obd_req
+        return can.Message(arbitration_id=obd_req.frame_id,
+                           is_extended_id=obd_req.frame_id >= 1 << 11,
+                           data=obd_req.encode(content))
+    
+    def _discard(self, pid: int, mode: int, future: Future):
+        """Removes an unanswered query from the pending responses.
+        
+        The time waited raises the round-trip average so the timeout
+        recovers if the ECU slows down.
+        """
+        with self._pending_lock:
+            if self._pending.get((mode, pid)) is future:
+                del self._pending[(mode, pid)]
+                sent_at = self._sent_at.pop((mode, pid), None)
+            else:
+                sent_at = None
+        future.cancel()
+        if sent_at is not None:
+            waited = time.monotonic() - sent_at
+            if waited > self._rtt_ewma:
+                self._rtt_ewma += RTT_EWMA_GAIN * (waited - self._rtt_ewma)
+    
+    def _resolve(self, mode: int, pid: int, signal: ObdSignal):
+        """Completes the pending query for a received response."""
+        with self._pending_lock:
+            future = self._pending.pop((mode, pid), None)
+            self._sent_at.pop((mode, pid), None)
+        if future is not None and future.set_running_or_notify_cancel():
+            future.set_result(signal)
+    
+    def _rx_dispatch(self):
+        """Receives CANbus responses and resolves the matching queries.
+        
+        Waits on a selector for the bus socket to become readable where the
+        bus provides a file descriptor, else blocks in `recv`.
+        Receive errors are logged and retried with exponential backoff up to
+        `MAX_RX_ERROR_BACKOFF` seconds so the receiver outlives a bus outage.
+        """
+        selector = selectors.DefaultSelector()
+        try:
+            selector.register(self.bus.fileno(), selectors.EVENT_READ)
+        except (NotImplementedError, ValueError, OSError):
+            selector.close()
+            selector = None
+        backoff = RX_ERROR_BACKOFF
+        while self.bus is not None:
+            try:
+                if selector is None:
+                    response = self.bus.recv(timeout=self.scan_timeout)
+                elif selector.select(timeout=self.scan_timeout):
+                    response = self.bus.recv(timeout=0)
                 else:
-                    decoded = self._db.decode_message(response.arbitration_id,
-                                                      response.data)
-                    _log.debug(f'CANbus received: {decoded}')
-                    if pid_mux not in decoded:
-                        continue
-                    rx_mode = decoded['service'].value
-                    rx_pid = decoded[pid_mux].value
-                    value = decoded[ObdSignal.get_name_by_pid(rx_pid, rx_mode)]
-                    if rx_mode == 9 and rx_pid == 1:
-                        self.vin_message_count = value
-                    signal = ObdSignal(mode, rx_pid, value, response_time)
-        if not signal:
-            _log.warning(f'No response received for mode {mode} PID {pid}')
-        return signal
+                    response = None
+            except (OSError, can.CanError) as err:
+                _log.error('CANbus receive failed: %s - retry in %s s',
+                           err, backoff)
+                time.sleep(backoff)
+                backoff = min(backoff * 2, MAX_RX_ERROR_BACKOFF)
+                continue
+            backoff = RX_ERROR_BACKOFF
+            if response:
+                # kernel receive timestamp in seconds, as unix nanoseconds
+                response_time = int(response.timestamp * 1e9)
+                try:
+                    self._dispatch(response, response_time)
+                except (KeyError, ValueError, IndexError, DecodeError) as err:
+                    _log.debug('Ignoring unparsed %s: %s', response, err)
+                except Exception:
+                    _log.exception(f'Error processing {response}')
+    
+    def _has_obd_header(self) -> bool:
+        """Checks the DBC response starts with [length, 0x40+mode, pid]."""
+        name = ObdSignal.get_name_by_pid(0x0D, 1)
+        try:
+            data = self._obd_res.encode({
+                'length': 3,
+                'response': 4,
+                'service': 1,
+                'PID_S1': 0x0D,
+                name: 0,
+            })
+        except Exception:
+            return False
+        return data[:3] == bytes([3, 0x41, 0x0D])
+    
+    def _get_decoder(self, mode: int, pid: int) -> 'Callable|None':
+        """Gets the direct decoder for a PID value, if one can be built."""
+        try:
+            return self._decoders[(mode, pid)]
+        except KeyError:
+            decoder = self._build_decoder(mode, pid)
+            self._decoders[(mode, pid)] = decoder
+            return decoder
+    
+    def _build_decoder(self, mode: int, pid: int) -> 'Callable|None':
+        """Builds a decoder for a byte-aligned big endian PID signal.
+        
+        Returns None if the signal needs the full cantools decode.
+        """
+        name = ObdSignal.get_name_by_pid(pid, mode)
+        try:
+            signal = self._obd_res.get_signal_by_name(name)
+        except KeyError:
+            return None
+        if (signal.multiplexer_signal != PID_MUX[mode] or
+            pid not in (signal.multiplexer_ids or []) or
+            signal.byte_order != 'big_endian' or
+            signal.start % 8 != 7 or signal.length % 8 != 0):
+            return None
+        start = signal.start // 8
+        end = start + signal.length // 8
+        scale = signal.scale
+        offset = signal.offset
+        signed = signal.is_signed
+        
+        def decode(data: bytes):
+            raw = int.from_bytes(data[start:end], 'big', signed=signed)
+            return raw * scale + offset
+        
+        return decode
     
-    def _parse_vin_part(self, data: bytes, part: int) -> str:
-        if part == 1:
-            vin_part_bytes = data[5:8]
+    def _dispatch(self, response: can.Message, response_time: int):
+        """Parses a received CANbus message into a response ObdSignal."""
+        if response.arbitration_id != self._obd_res.frame_id:
+            return
+        data = response.data
+        if self._obd_header and data[0] < 0x10 and data[1] >> 4 == 4:
+            rx_mode = data[1] & 0x0F
+            rx_pid = data[2]
+            decoder = self._get_decoder(rx_mode, rx_pid)
+            if decoder is not None:
+                self._on_response(rx_mode, rx_pid, decoder(data),
+                                  response_time)
+                return
+        if (data[0] & 0xF0) in (0x10, 0x20):
+            if (9, 2) not in self._pending:
+                return
+            if data[0] & 0xF0 == 0x10:
+                self._vin_parts = [data]
+                self._vin_length = ((data[0] & 0x0F) << 8) | data[1]
+                self._send_flow_control(response.arbitration_id,
+                                        response.is_extended_id)
+            elif self._vin_parts:
+                self._vin_parts.append(data)
+            else:
+                return
+            # first frame carries 6 payload bytes, consecutive frames 7
+            expected = 1 + (max(0, self._vin_length - 6) + 6) // 7
+            if len(self._vin_parts) >= expected:
+                vin = self._parse_vin(self._vin_parts, self._vin_length)
+                self._resolve(9, 2, ObdSignal(9, 2, vin, ts=response_time))
+            return
+        decoded = self._obd_res.decode(response.data, decode_choices=False)
+        if _log.isEnabledFor(logging.DEBUG):
+            _log.debug('CANbus received: %s', decoded)
+        if 'service' not in decoded:
+            return
+        rx_mode = decoded['service']
+        pid_mux = PID_MUX.get(rx_mode)
+        if pid_mux not in decoded:
+            return
+        rx_pid = decoded[pid_mux]
+        value = decoded[ObdSignal.get_name_by_pid(rx_pid, rx_mode)]
+        self._on_response(rx_mode, rx_pid, value, response_time)
+    
+    def _send_flow_control(self, response_id: int, extended_id: bool = False):
+        """Requests the remaining consecutive frames of a multi-frame response.
+        
+        Sent to the responding ECU's physical address so it transmits all
+        consecutive frames back-to-back. For 29-bit IDs the physical address
+        swaps the target and source bytes of the response ID.
+        """
+        if not extended_id:
+            physical_id = response_id - PHYSICAL_ID_OFFSET
+        elif response_id & 0xFFFF0000 == PHYSICAL_ID_29_PREFIX:
+            physical_id = (PHYSICAL_ID_29_PREFIX |
+                           (response_id & 0xFF) << 8 |
+                           (response_id >> 8) & 0xFF)
         else:
-            vin_part_bytes = data[1:]
-        vin_part = ''.join(chr(c) for c in vin_part_bytes)
-        _log.warning('VIN parsing not fully tested')
-        return vin_part
+            _log.warning('No flow control for response ID 0x%X', response_id)
+            return
+        self.bus.send(can.Message(arbitration_id=physical_id,
+                                  is_extended_id=extended_id,
+                                  data=FLOW_CONTROL_CTS))
+    
+    def _on_response(self, mode: int, pid: int, value, response_time: int):
+        """Resolves the pending query with the decoded response value.
+        
+        Updates the round-trip average from the query's send time.
+        """
+        with self._pending_lock:
+            sent_at = self._sent_at.pop((mode, pid), None)
+        if sent_at is not None:
+            rtt = time.monotonic() - sent_at
+            self._rtt_ewma += RTT_EWMA_GAIN * (rtt - self._rtt_ewma)
+        if mode == 9 and pid == 1:
+            self.vin_message_count = value
+        self._resolve(mode, pid, ObdSignal(mode, pid, value, response_time))
+    
+    @staticmethod
+    def _parse_vin(frames: 'list[bytes]', length: int) -> str:
+        """Reassembles the VIN from the ISO-TP frames of a 09/02 response.
+        
+        Args:
+            frames: The first frame followed by its consecutive frames.
+            length: The payload length from the first frame.
+        
+        Returns:
+            The VIN following the `49 02 <count>` payload header.
+        
+        """
+        payload = bytes(frames[0][2:]) + b''.join(bytes(frame[1:])
+                                                   for frame in frames[1:])
+        return payload[3:length].decode('ascii', errors='replace')
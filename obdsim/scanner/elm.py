@@ -2,7 +2,8 @@
 import logging
 import time
 
-from obdsim.elm import Elm327, ElmStatus
+from obdsim.elm import MAX_PIDS_PER_QUERY, Elm327, ElmStatus
+from obdsim.obdsignal import PID_MUX
 
 from .base_scanner import ObdScanner, ObdSignal
 
@@ -67,16 +68,94 @@ class ElmScanner(ObdScanner):
             return
         res: bytes = self.elm.query_pid(pid, mode)
         if res:
-            response_time = time.time()
-            while len(res) < 8:
-                _log.debug(f'Padding ELM response with zero byte')
-                res = bytearray(res + b'\x00')
-            decoded = self._db.decode_message(self._obd_res.frame_id, res)
-            rx_mode = decoded['service'].value
-            pid_mux = f'PID_S{mode:01x}'
-            rx_pid = decoded[pid_mux].value
+            response_time = time.time_ns()
+            decoded = self._obd_res.decode(res.ljust(8, b'\x00'),
+                                           decode_choices=False)
+            rx_mode = decoded['service']
+            rx_pid = decoded[PID_MUX[rx_mode]]
             if rx_mode != mode or rx_pid != pid:
                 _log.warning('Mode or PID mismatch')
-            value = decoded[ObdSignal.get_name_by_pid(rx_pid)]
+            value = decoded[ObdSignal.get_name_by_pid(rx_pid, rx_mode)]
             return ObdSignal(rx_mode, rx_pid, value, response_time)
         _log.warning(f'No response to query')
+    
+    def query_multi(self,
+                    pids: 'list[int]',
+                    mode: int = 1,
+                    ) -> 'list[ObdSignal|None]':
+        """Queries up to `MAX_PIDS_PER_QUERY` PIDs in a single request.
+        
+        Returns:
+            A list of signals (or None) in the same order as `pids`.
+        
+        """
+        if not self.is_connected:
+            _log.warning('Vehicle not connected or ignition is off - skipping')
+            return [None] * len(pids)
+        payload: bytes = self.elm.query_pids(pids, mode)
+        response_time = time.time_ns()
+        if not payload or payload[0] != 0x40 | mode:
+            _log.warning('No valid response to query')
+            return [None] * len(pids)
+        results: 'dict[int, ObdSignal]' = {}
+        i = 1
+        while i < len(payload):
+            rx_pid = payload[i]
+            pid_def = ObdSignal.get_definition(rx_pid, mode)
+            if pid_def is None:
+                data_length = self._dbc_data_length(rx_pid, mode)
+                if data_length is None:
+                    _log.warning(f'Unknown PID {rx_pid} in response'
+                                 ' - stopping')
+                    break
+                _log.debug('Skipping undefined PID %d in response', rx_pid)
+                i += 1 + data_length
+                continue
+            data_end = i + pid_def.length - 1
+            frame = bytes([pid_def.length, 0x40 | mode]) + payload[i:data_end]
+            decoded = self._obd_res.decode(frame.ljust(8, b'\x00'),
+                                           decode_choices=False)
+            results[rx_pid] = ObdSignal(mode,
+                                        rx_pid,
+                                        decoded[pid_def.name],
+                                        response_time)
+            i = data_end
+        return [results.get(pid) for pid in pids]
+    
+    def _dbc_data_length(self, pid: int, mode: int = 1) -> 'int|None':
+        """Gets the number of data bytes of a PID from the DBC response.
+        
+        Used to step over PIDs the vehicle reports that have no
+        `PID_DEFINITIONS` entry.
+        
+        Returns:
+            The data length in bytes, or None if the DBC does not define it.
+        
+        """
+        end = 0
+        for signal in self._obd_res.signals:
+            if (signal.multiplexer_signal != PID_MUX[mode] or
+                pid not in (signal.multiplexer_ids or []) or
+                signal.byte_order != 'big_endian'):
+                continue
+            first_byte_bits = signal.start % 8 + 1
+            extra_bits = max(0, signal.length - first_byte_bits)
+            end = max(end, signal.start // 8 + 1 + (extra_bits + 7) // 8)
+        # data follows the [length, mode, pid] header bytes
+        return end - 3 if end > 3 else None
+    
+    def _scan_once(self) -> int:
+        """Queries supported PIDs in batches of `MAX_PIDS_PER_QUERY`.
+        
+        PIDs without a definition are not queried since their values cannot
+        be represented as an `ObdSignal`.
+        """
+        updated = 0
+        for mode, pids in self._scan_pids.items():
+            pids = [pid for pid in pids
+                    if ObdSignal.get_definition(pid, mode) is not None]
+            for i in range(0, len(pids), MAX_PIDS_PER_QUERY):
+                batch = pids[i:i + MAX_PIDS_PER_QUERY]
+                for pid, signal in zip(batch, self.query_multi(batch, mode)):
+                    updated += self._update_signal(mode, pid, signal)
+        return updated
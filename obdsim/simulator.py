@@ -1,19 +1,31 @@
 """A basic vehicle simulator generating responses to supported OBD2 queries."""
 import logging
 import os
+import selectors
+import socket
 import threading
+import time
+from typing import Any, Callable
 
 import can
 from cantools.database import Database as CanDatabase
+from cantools.database import DecodeError, EncodeError
 from cantools.database import Message as CanMessage
-from cantools.database import load_file as load_can_database
 
-from obdsim.obdsignal import ObdSignal, ObdSupportedPids
+from obdsim.obdsignal import (PID_DEFINITIONS, PID_MUX, ObdSignal,
+                              ObdSupportedPids, ObdVin)
+from obdsim.utils.dbc import load_dbc
 
 DBC_FILE = os.getenv('DBC_FILE', './dbc/python-obd.dbc')
 DBC_REQUEST = os.getenv('DBC_REQUEST', 'OBD2_REQUEST')
 DBC_RESPONSE = os.getenv('DBC_RESPONSE', 'OBD2_ECU_RESPONSE')
 SIMULATOR_VIN = os.getenv('SIMULATOR_VIN', '1OBDIISIMULATORXX')
+MAX_STANDARD_ID = 0x7FF   #: Highest 11-bit CAN arbitration ID
+MAX_EXTENDED_ID = 0x1FFFFFFF   #: Highest 29-bit CAN arbitration ID
+BUSY_POLL_US = int(os.getenv('OBDSIM_BUSY_POLL_US', '0'))   #: 0 disables
+SO_BUSY_POLL = getattr(socket, 'SO_BUSY_POLL', 46)   #: Linux value
+RX_ERROR_BACKOFF = 0.1   #: Initial seconds to wait after a receive error
+MAX_RX_ERROR_BACKOFF = 5   #: Upper limit seconds between receive retries
 
 SIMULATED_SIGNALS = {
     'S1_PIDS_01_20': None,
@@ -64,16 +76,26 @@ class ObdSimulator:
                 definition within the DBC file.
             timeout: The bus timeout in seconds.
         """
-        self._db: CanDatabase = load_can_database(dbc_filename)
+        self._db: CanDatabase = load_dbc(dbc_filename)
         self._obd_req: CanMessage = self._db.get_message_by_name(dbc_request)
         self._obd_res: CanMessage = self._db.get_message_by_name(dbc_response)
+        self._req_extended_id: bool = self._obd_req.frame_id > MAX_STANDARD_ID
+        self._res_extended_id: bool = self._obd_res.frame_id > MAX_STANDARD_ID
         self._bus_name: str = canbus_name
         self._bus: can.Bus = None
+        self._bus_ready = threading.Event()
         self.timeout: float = timeout
         self._listener = threading.Thread(target=self._listen,
                                           name='obd_listener',
                                           daemon=True)
-        self.signals = {}
+        self.signals: 'dict[str, Any]' = {}
+        # _pid_masks as [(mode, pid)] = supported PIDs bitmask for the range
+        self._pid_masks: 'dict[tuple[int, int], int]' = self._build_pid_masks()
+        # _encoded as [(mode, pid)] = (response content, message) last sent
+        self._encoded: 'dict[tuple[int, int], tuple[tuple, can.Message]]' = {}
+        # _encoders as [(mode, pid)] = direct encoder or None to use cantools
+        self._encoders: 'dict[tuple[int, int], Callable|None]' = {}
+        self._vin_frames: 'list[bytes]' = self._build_vin_frames()
     
     def start(self):
         """Starts listening for queries on the CANbus."""
@@ -88,30 +110,100 @@ class ObdSimulator:
                 bus_name = self._bus_name
         elif not self._bus_name:
             self._bus_name = bus_name
-        sys_name = f'/sys/class/net/{bus_name}'
-        if not os.path.exists(sys_name):
-            raise FileNotFoundError(f'Cannot find {sys_name}')
+        try:
+            socket.if_nametoindex(bus_name)
+        except OSError as exc:
+            raise FileNotFoundError(f'Cannot find CANbus {bus_name}') from exc
         _log.debug(f'Using CANbus {bus_name}')
         self._bus = can.Bus(bus_name, bustype='socketcan')
+        # socketcan applies the filter in the kernel, other frames never wake
+        id_mask = MAX_EXTENDED_ID if self._req_extended_id else MAX_STANDARD_ID
+        self._bus.set_filters([{
+            'can_id': self._obd_req.frame_id,
+            'can_mask': id_mask,
+            'extended': self._req_extended_id,
+        }])
+        if BUSY_POLL_US:
+            self._set_busy_poll(BUSY_POLL_US)
+        self._bus_ready.set()
+    
+    def _set_busy_poll(self, microseconds: int):
+        """Sets the socket to busy poll the device before sleeping on receive.
+        
+        Increasing above the `net.core.busy_read` sysctl requires
+        CAP_NET_ADMIN and only helps where the CAN driver supports it.
+        """
+        try:
+            self._bus.socket.setsockopt(socket.SOL_SOCKET,
+                                        SO_BUSY_POLL,
+                                        microseconds)
+            _log.debug(f'Busy polling {microseconds} us on receive')
+        except (AttributeError, OSError) as err:
+            _log.warning(f'Unable to set busy poll: {err}')
     
     def _listen(self):
-        """Loops checking for incoming requests on the CANbus."""
+        """Loops checking for incoming requests on the CANbus.
+        
+        Waits for `connect` if started before the bus is available.
+        Waits on a selector for the bus socket to become readable where the
+        bus provides a file descriptor, else blocks in `recv`.
+        Each wakeup handles all frames already queued before waiting again.
+        Receive errors are logged and retried with exponential backoff up to
+        `MAX_RX_ERROR_BACKOFF` seconds.
+        """
+        self._bus_ready.wait()
         _log.info(f'Listening on {self._bus_name}...')
+        selector = selectors.DefaultSelector()
+        try:
+            selector.register(self._bus.fileno(), selectors.EVENT_READ)
+        except (NotImplementedError, ValueError, OSError):
+            selector.close()
+            selector = None
+        recv = self._bus.recv
+        handle = self._handle
+        backoff = RX_ERROR_BACKOFF
         while True:
-            received = self._bus.recv(timeout=self.timeout)
-            if received:
-                _log.debug(f'CANbus received: {received.data}')
-                try:
-                    decoded = self._db.decode_message(received.arbitration_id,
-                                                      received.data)
-                    _log.debug(f'Decoded: {decoded}')
-                    if 'request' in decoded:
-                        extended_id = received.arbitration_id >= 2**11
-                        self._process_request(decoded, extended_id)
-                    else:
-                        _log.debug(f'Ignoring message: {decoded}')
-                except KeyError:
-                    _log.error(f'Error decoding CAN message: {received}')
+            try:
+                if selector is None:
+                    received = recv(timeout=self.timeout)
+                elif selector.select(timeout=self.timeout):
+                    received = recv(timeout=0)
+                else:
+                    continue
+                while received is not None:
+                    handle(received)
+                    received = recv(timeout=0)
+            except (OSError, can.CanError) as err:
+                _log.error('CANbus receive failed: %s - retry in %s s',
+                           err, backoff)
+                time.sleep(backoff)
+                backoff = min(backoff * 2, MAX_RX_ERROR_BACKOFF)
+                continue
+            backoff = RX_ERROR_BACKOFF
+    
+    def _handle(self, received: can.Message):
+        """Processes a received CANbus message."""
+        _log.debug('CANbus received: %s', received.data)
+        if received.data and received.data[0] & 0xF0 == 0x30:
+            _log.debug('Ignoring ISO-TP flow control')
+            return
+        if received.arbitration_id != self._obd_req.frame_id:
+            _log.debug('Ignoring non-request message')
+            return
+        try:
+            decoded = self._obd_req.decode(received.data,
+                                           decode_choices=False,
+                                           scaling=False)
+            if _log.isEnabledFor(logging.DEBUG):
+                _log.debug('Decoded: %s', decoded)
+            if 'request' in decoded:
+                self._process_request(decoded, self._req_extended_id)
+            else:
+                _log.debug('Ignoring message: %s', decoded)
+        except (KeyError, ValueError, DecodeError) as err:
+            _log.error('Error decoding CAN message: %s (%s)', received, err)
+        except Exception:
+            _log.exception('Error processing CAN message: %s', received)
     
     def _process_request(self, request, extended_id: bool = None):
         """Parses a request and generates a response."""
@@ -122,11 +214,11 @@ class ObdSimulator:
         #     'PID_S1': 13,   # PID mux defined in DBC
         #     'SPEED': 50,   # derived from DBC
         # }
-        _log.info(f'Processing {request}')
+        _log.info('Processing %s', request)
         if 'service' not in request:
             raise ValueError('OBD request or db missing mode')
         service_mode = request['service']
-        pid_mux = f'PID_S{service_mode:01x}'
+        pid_mux = PID_MUX.get(service_mode)
         if pid_mux not in request:
             raise ValueError(f'Missing PID value for {pid_mux}')
         pid = request[pid_mux]
@@ -139,21 +231,106 @@ class ObdSimulator:
         if response is None:
             return
         if 'length' not in response:
-            _log.warning(f'No simulation for mode {service_mode} PID {pid}')
+            _log.warning('No simulation for mode %d PID %d', service_mode, pid)
         else:
-            _log.info(f'Simulating response: {response}')
-            data = self._obd_res.encode(response)
-            self.send_response_data(data, extended_id)
+            _log.info('Simulating response: %s', response)
+            key = (service_mode, pid)
+            content = (extended_id, tuple(response.items()))
+            cached = self._encoded.get(key)
+            if cached is not None and cached[0] == content:
+                message = cached[1]
+            else:
+                message = self._response_message(
+                    self._encode(service_mode, pid, response), extended_id)
+                self._encoded[key] = (content, message)
+            _log.debug('Sending raw CAN data: %s', message)
+            self._bus.send(message)
+    
+    def _encode(self, mode: int, pid: int, response: dict) -> bytes:
+        """Encodes a response, directly if the PID layout allows."""
+        encoder = self._encoders.get((mode, pid))
+        if encoder is not None:
+            return encoder(response)
+        data = self._obd_res.encode(response)
+        if (mode, pid) not in self._encoders:
+            self._encoders[(mode, pid)] = self._build_encoder(mode, pid, data)
+        return data
+    
+    def _build_encoder(self,
+                       mode: int,
+                       pid: int,
+                       template: bytes,
+                       ) -> 'Callable|None':
+        """Builds an encoder for a byte-aligned big endian PID signal.
+        
+        The bytes around the value are copied from a cantools encoded
+        response of the same PID. Values outside the DBC `[min|max]` or the
+        signal width raise `EncodeError` as cantools would.
+        Returns None if the signal needs the full cantools encode.
+        """
+        name = ObdSignal.get_name_by_pid(pid, mode)
+        try:
+            signal = self._obd_res.get_signal_by_name(name)
+        except KeyError:
+            return None
+        if (signal.multiplexer_signal != PID_MUX[mode] or
+            pid not in (signal.multiplexer_ids or []) or
+            signal.byte_order != 'big_endian' or
+            signal.start % 8 != 7 or signal.length % 8 != 0):
+            return None
+        start = signal.start // 8
+        end = start + signal.length // 8
+        head = bytes(template[:start])
+        tail = bytes(template[end:])
+        scale = signal.scale
+        offset = signal.offset
+        signed = signal.is_signed
+        minimum = signal.minimum
+        maximum = signal.maximum
+        
+        def encode(response: dict) -> bytes:
+            value = response[name]
+            if ((minimum is not None and value < minimum) or
+                (maximum is not None and value > maximum)):
+                raise EncodeError(f'Expected signal "{name}" value in'
+                                  f' [{minimum}, {maximum}] but got {value}')
+            raw = round((value - offset) / scale)
+            try:
+                data = raw.to_bytes(end - start, 'big', signed=signed)
+            except OverflowError as exc:
+                raise EncodeError(f'Signal "{name}" value {value}'
+                                  ' does not fit the signal') from exc
+            return head + data + tail
+        
+        return encode
 
     def send_response_data(self, data: bytes, extended_id: bool = None):
-        """Sends a response message on the CANbus."""
-        if extended_id is None:
-            extended_id = self._obd_res.frame_id >= 2**11
-        message = can.Message(arbitration_id=self._obd_res.frame_id,
-                              is_extended_id=extended_id,
-                              data=data)
-        _log.debug(f'Sending raw CAN data: {message}')
+        """Sends a response message on the CANbus.
+        
+        Args:
+            data: The encoded response payload.
+            extended_id: Override of the response arbitration ID width.
+        
+        Raises:
+            TypeError: If `data` is not bytes-like.
+            
+        """
+        if not isinstance(data, (bytes, bytearray)):
+            raise TypeError(f'Invalid response data type {type(data)}')
+        message = self._response_message(data, extended_id)
+        _log.debug('Sending raw CAN data: %s', message)
         self._bus.send(message)
+    
+    def _response_message(self,
+                          data: bytes,
+                          extended_id: bool = None,
+                          ) -> can.Message:
+        """Builds a response message for the encoded data."""
+        if extended_id is None:
+            extended_id = self._res_extended_id
+        return can.Message(arbitration_id=self._obd_res.frame_id,
+                           is_extended_id=extended_id,
+                           data=data)
         
     def pids_supported(self, pid: int, mode: int = 1) -> int:
         """Generates the bitmask for a response to supported pids 0x01-0x20
@@ -162,35 +339,54 @@ class ObdSimulator:
             Integer of the 32-bit bitmask.
             
         """
-        supported = []
-        for sim in SIMULATED_SIGNALS:
-            candidate_pid = ObdSignal.get_pid_by_name(sim, mode)
-            if candidate_pid and candidate_pid in range(pid + 1, pid + 32 + 1):
-                supported.append(candidate_pid)
-        o = ObdSupportedPids(mode, pid)
-        o.pids = supported
-        return o.value
+        return self._pid_masks.get((mode, pid), 0)
+    
+    @staticmethod
+    def _build_pid_masks() -> 'dict[tuple[int, int], int]':
+        """Builds the supported PIDs bitmasks for the simulated signals."""
+        masks = {}
+        for mode in { pid_def.mode for pid_def in PID_DEFINITIONS }:
+            for sim in SIMULATED_SIGNALS:
+                candidate_pid = ObdSignal.get_pid_by_name(sim, mode)
+                if not candidate_pid:
+                    continue
+                base = (candidate_pid - 1) // 32 * 32
+                masks[(mode, base)] = (masks.get((mode, base), 0) |
+                                       1 << (candidate_pid - base - 1))
+        return masks
 
     def sim_response(self, mode: int, pid: int, response: dict) -> 'dict|None':
         """Populates the response dictionary"""
-        pid_name = ObdSignal.get_name_by_pid(pid, mode)
-        if pid_name not in SIMULATED_SIGNALS:
-            _log.warning(f'Unsupported mode {mode} pid {pid}')
+        pid_def = ObdSignal.get_definition(pid, mode)
+        if pid_def is None or pid_def.name not in SIMULATED_SIGNALS:
+            _log.warning('Unsupported mode %d pid %d', mode, pid)
             return
-        if pid_name not in self.signals or self.signals[pid_name] is None:
-            if '_PIDS_' in pid_name:
-                self.signals[pid_name] = self.pids_supported(pid, mode)
+        pid_name = pid_def.name
+        value = self.signals.get(pid_name)
+        if value is None:
+            if pid_def.data_type is ObdSupportedPids:
+                value = self.pids_supported(pid, mode)
             else:
-                self.signals[pid_name] = SIMULATED_SIGNALS[pid_name]
-        if pid_name.endswith('VIN'):
+                value = SIMULATED_SIGNALS[pid_name]
+            self.signals[pid_name] = value
+        if pid_def.data_type is ObdVin:
             self.sim_vin()
             return None
-        signal = ObdSignal(mode, pid, self.signals[pid_name])
-        response['length'] = signal.length
-        response[pid_name] = signal.value_raw
+        # length is fixed per PID and the simulated value is encoded as-is
+        response['length'] = pid_def.length
+        response[pid_name] = value
         return response
         
     def sim_vin(self, extended_id: bool = None):
+        """Sends the multi-frame VIN response."""
+        for i, data in enumerate(self._vin_frames):
+            _log.debug('Sending VIN part %d of %d',
+                       i + 1, len(self._vin_frames))
+            self.send_response_data(data, extended_id)
+    
+    @staticmethod
+    def _build_vin_frames() -> 'list[bytes]':
+        """Builds the multi-frame response data for the simulated VIN."""
         if len(SIMULATOR_VIN) != 17:
             _log.warning(f'Invalid VIN {SIMULATOR_VIN}')
         vin_parts = (
@@ -198,13 +394,11 @@ class ObdSimulator:
             SIMULATOR_VIN[3:10],
             SIMULATOR_VIN[10:17]
         )
+        frames = []
         for i, part in enumerate(vin_parts):
             if i == 0:
-                data_hex = '1014490201'
+                header = b'\x10\x14\x49\x02\x01'
             else:
-                data_hex = f'{20 + i}'
-            for c in part:
-                data_hex += f'{ord(c):02x}'.upper()
-            data = bytes.fromhex(data_hex)
-            _log.debug(f'Sending VIN part {i + 1} of {len(vin_parts)}')
-            self.send_response_data(data, extended_id)
+                header = bytes([0x20 + i])
+            frames.append(header + part.encode('ascii'))
+        return frames
@@ -0,0 +1,27 @@
+import functools
+import os
+
+from cantools.database import Database as CanDatabase
+from cantools.database import load_file as load_can_database
+
+
+def load_dbc(dbc_filename: str) -> CanDatabase:
+    """Loads a DBC file, reusing the parsed database if the file is unchanged.
+    
+    The database is read-only once loaded so may be shared across scanners
+    and simulators.
+    
+    Args:
+        dbc_filename: The file path/name of the DBC.
+    
+    Returns:
+        The cantools Database.
+    
+    """
+    return _load_dbc(dbc_filename, os.path.getmtime(dbc_filename))
+
+
+@functools.lru_cache(maxsize=8)
+def _load_dbc(dbc_filename: str, mtime: float) -> CanDatabase:
+    """Loads a DBC file, cached by path and modification time."""
+    return load_can_database(dbc_filename)
@@ -1,13 +1,52 @@
 import logging
-import os
+import socket
 import subprocess
 
+try:
+    from pyroute2 import IPRoute, NetlinkError
+except ImportError:
+    IPRoute = NetlinkError = None
+
 _log = logging.getLogger(__name__)
 
 
 def create_vcan(bus_name: str = 'vcan0') -> str:
     _log.debug(f'Attempting to create virtual {bus_name}')
-    sys_name = f'/sys/class/net/{bus_name}'
+    if not (IPRoute and _create_vcan_netlink(bus_name)):
+        _create_vcan_shell(bus_name)
+    try:
+        socket.if_nametoindex(bus_name)
+    except OSError as exc:
+        raise FileNotFoundError(f'Cannot find {bus_name}') from exc
+
+
+def _create_vcan_netlink(bus_name: str) -> bool:
+    """Creates and raises the interface directly via netlink (`pyroute2`).
+    
+    Requires CAP_NET_ADMIN. The kernel loads the vcan module on demand.
+    An existing interface is only set up.
+    
+    Returns:
+        True if successful, False to fall back to shell commands.
+    
+    """
+    if IPRoute is None:
+        return False
+    try:
+        with IPRoute() as ipr:
+            indices = ipr.link_lookup(ifname=bus_name)
+            if not indices:
+                ipr.link('add', ifname=bus_name, kind='vcan')
+                indices = ipr.link_lookup(ifname=bus_name)
+            ipr.link('set', index=indices[0], state='up')
+        return True
+    except (ImportError, NetlinkError) as err:
+        _log.debug(f'Netlink vcan creation failed ({err}) - using sudo')
+        return False
+
+
+def _create_vcan_shell(bus_name: str):
+    """Creates and raises the interface via `sudo` shell commands."""
     shell_commands = [
         'sudo modprobe vcan',
         f'sudo ip link add dev {bus_name} type vcan',
@@ -18,5 +57,3 @@ def create_vcan(bus_name: str = 'vcan0') -> str:
         if rc != 0:
             _log.warning(f'{command} failed with return code {rc}')
             raise OSError
-    if not os.path.exists(sys_name):
-        raise FileNotFoundError(f'Cannot find {sys_name}')
@@ -1,5 +1,8 @@
-from obdsim.scanner import ObdScanner
-from obdsim.obdsignal import decode_pids_supported, encode_pids_supported
+import pytest
+
+from obdsim.scanner import CanScanner, ObdScanner
+from obdsim.obdsignal import (ObdSupportedPids, decode_pids_supported,
+                              encode_pids_supported, pids_from_bitmask)
 
 
 def test_pids_supported_codec():
@@ -17,7 +20,7 @@ def test_pids_supported_codec():
                                          response_data)
     mode = decoded['service'].value
     pid = decoded[f'PID_S{mode}'].value
-    value = decoded['PIDS_A']
+    value = decoded['S1_PIDS_01_20']
     assert mode == 1
     assert pid == 0
     assert value == 3214911635
@@ -27,20 +30,46 @@ def test_pids_supported_codec():
     assert bm == value
 
 
+def test_pids_supported_merge():
+    previous = { 1: [1, 2, 5] }
+    merged = decode_pids_supported(1, 0, 0b10011, previous)
+    assert merged is previous
+    assert merged == { 1: [1, 2, 5] }
+    merged = decode_pids_supported(9, 0, 0b110, previous)
+    assert merged == { 1: [1, 2, 5], 9: [2, 3] }
+    empty = {}
+    assert decode_pids_supported(1, 0, 0b1, empty) is empty
+    assert decode_pids_supported(1, 0, 0b10) == { 1: [2] }
+
+
+def test_decode_many():
+    np = pytest.importorskip('numpy')
+    pids = np.array([0x00, 0x20, 0x40, 0x00, 0x20, 0x40], dtype=np.int64)
+    values = np.array([3214911635, 0x80000001, 0,
+                       0xFFFFFFFF, 0x0000A000, 1 << 31], dtype=np.uint32)
+    # strided views as produced by slicing logged data
+    for pid_view, value_view in ((pids, values), (pids[::2], values[::2])):
+        decoded = ObdSupportedPids.decode_many(pid_view, value_view)
+        assert decoded == [pids_from_bitmask(int(v), int(p))
+                           for p, v in zip(pid_view, value_view)]
+
+
 def test_vin_codec():
-    scanner = ObdScanner()
+    scanner = CanScanner()
     # Response from F150 2014 using Elm 327 v1.5 command `0902`
     # ELM headers enabled to get transmitter / arbitration ID (7E8 prefix)
-    # ELM response excludes unused 8th byte so we pad with an arbitrary byte
+    # ELM response excludes unused 8th byte so we pad with a zero byte
     elm_response = '7E81014490201314654\r7E82146573145465845\r7E82246423334343739\r'
-    response_parts = elm_response.split('\r')
-    for i, part in enumerate(response_parts):
-        response_arbitration_id = int(part[:3], 16)
-        response_data = bytearray(bytes.fromhex(part.strip()[3:]))
-        pad = bytearray()
-        for p in range(0, 8 - len(response_data)):
-            pad.append(b'\x00')
-        assert False, 'VIN parsing not implemented'
+    frames = [(int(part[:3], 16), bytes.fromhex(part[3:]))
+              for part in elm_response.rstrip('\r').split('\r')]
+    vin_frames = []
+    for response_arbitration_id, response_data in frames:
+        assert response_arbitration_id == scanner._obd_res.frame_id
+        response_data += bytes(8 - len(response_data))
+        assert len(response_data) == 8
+        vin_frames.append(response_data)
+    length = ((vin_frames[0][0] & 0x0F) << 8) | vin_frames[0][1]
+    assert scanner._parse_vin(vin_frames, length) == '1FTFW1EFXEFB34479'
 
 
 if __name__ == '__main__':
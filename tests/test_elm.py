@@ -0,0 +1,82 @@
+import pytest
+
+from obdsim.elm import Elm327, ElmStatus
+from obdsim.scanner import ElmScanner, ObdScanner
+
+
+class _FakeElm(Elm327):
+    """An ELM327 returning canned response lines without a connection."""
+    status = ElmStatus.CAR_CONNECTED
+    
+    def __init__(self, responses: 'list[str]'):
+        self.responses = responses
+        self.sent = []
+    
+    def get_response(self, data: str, **kwargs) -> 'list[str]':
+        self.sent.append(data)
+        return list(self.responses)
+    
+    def disconnect(self):
+        pass
+
+
+def _elm_scanner(responses: 'list[str]') -> ElmScanner:
+    scanner = ElmScanner.__new__(ElmScanner)
+    ObdScanner.__init__(scanner)
+    scanner.elm = _FakeElm(responses)
+    return scanner
+
+
+def test_query_pids_single_frame():
+    elm = _FakeElm(['7E8 06 41 0C 1A F8 0D 32 00'])
+    assert elm.query_pids([0x0C, 0x0D]) == bytes.fromhex('410C1AF80D32')
+    assert elm.sent == ['010c0d']
+
+
+def test_query_pids_multi_frame():
+    elm = _FakeElm(['7E8 10 0B 41 0C 1A F8 0D 32',
+                    '7E8 21 5C 64 21 00 10 00 00'])
+    payload = elm.query_pids([0x0C, 0x0D, 0x5C, 0x21])
+    assert payload == bytes.fromhex('410C1AF80D325C64210010')
+
+
+def test_query_pids_multi_ecu():
+    elm = _FakeElm(['7E8 03 41 0D 32 00 00 00 00',
+                    '7E9 03 41 0D 33 00 00 00 00'])
+    assert elm.query_pids([0x0D]) == bytes.fromhex('410D32')
+
+
+def test_query_multi():
+    scanner = _elm_scanner(['7E8 10 0B 41 0C 1A F8 0D 32',
+                            '7E8 21 5C 64 21 00 10 00 00'])
+    signals = scanner.query_multi([0x0C, 0x0D, 0x5C, 0x21])
+    assert [signal.pid for signal in signals] == [0x0C, 0x0D, 0x5C, 0x21]
+    assert [signal.value_raw for signal in signals] == [1726, 50, 60, 16]
+
+
+def test_query_multi_skips_undefined_pid():
+    # 0x05 coolant temperature is in the DBC but not in PID_DEFINITIONS
+    scanner = _elm_scanner(['7E8 10 08 41 05 7B 0C 1A F8',
+                            '7E8 21 0D 32 00 00 00 00 00'])
+    signals = scanner.query_multi([0x05, 0x0C, 0x0D])
+    assert signals[0] is None
+    assert [signal.value_raw for signal in signals[1:]] == [1726, 50]
+
+
+def test_scan_once_queries_defined_pids():
+    scanner = _elm_scanner(['7E8 06 41 0C 1A F8 0D 32'])
+    scanner._scan_pids = { 1: [0x05, 0x0C, 0x0D] }
+    assert scanner._scan_once() == 2
+    assert scanner.elm.sent == ['010c0d']
+
+
+@pytest.mark.parametrize('status', [
+    'STOPPED', 'CAN ERROR', 'BUFFER FULL', '?', 'BUS BUSY', 'ERR94',
+])
+def test_query_pids_elm_errors(status):
+    elm = _FakeElm([status])
+    with pytest.raises(ConnectionError):
+        elm.query_pids([0x0C, 0x0D])
+    elm = _FakeElm(['7E8 10 0B 41 0C 1A F8 0D 32', status])
+    with pytest.raises(ConnectionError):
+        elm.query_pids([0x0C, 0x0D, 0x5C, 0x21])
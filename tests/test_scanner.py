@@ -0,0 +1,230 @@
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+import can
+import pytest
+
+from obdsim.obdsignal import PID_DEFINITIONS, PID_MUX, ObdVin
+from obdsim.scanner import CanScanner, ObdScanner
+from obdsim.scanner import base_scanner
+from obdsim.scanner import can as can_scanner
+from obdsim.scanner.base_scanner import MAX_BACKOFF_INTERVAL
+
+
+class _StopAfter:
+    """Stand-in for the scanner stop event that records the waits.
+    
+    Each wait advances a fake monotonic clock instead of sleeping.
+    """
+    def __init__(self, count: int):
+        self.count = count
+        self.waits = []
+        self.now = 0.0
+    
+    def monotonic(self) -> float:
+        return self.now
+    
+    def is_set(self) -> bool:
+        return len(self.waits) >= self.count
+    
+    def wait(self, timeout: float = None):
+        self.waits.append(timeout)
+        self.now += timeout
+
+
+def test_scan_loop_backs_off_on_bus_errors(monkeypatch):
+    scanner = ObdScanner(scan_interval=1)
+    errors = [can.CanOperationError('No buffer space available'),
+              OSError('Network is down'),
+              ConnectionError('NO DATA'),
+              ValueError('Unexpected frame type')]
+    
+    def scan_once():
+        if errors:
+            raise errors.pop(0)
+        return 1
+    
+    scanner._scan_once = scan_once
+    scanner._stop_event = _StopAfter(8)
+    monkeypatch.setattr(base_scanner.time, 'monotonic',
+                        scanner._stop_event.monotonic)
+    scanner._loop()
+    waits = scanner._stop_event.waits
+    assert waits[:4] == [1, 2, 4, 8]
+    assert all(w <= MAX_BACKOFF_INTERVAL for w in waits)
+    assert waits[4:] == [1, 1, 1, 1]
+
+
+def test_direct_decoder_matches_cantools():
+    scanner = CanScanner()
+    rng = random.Random(0)
+    for pid_def in PID_DEFINITIONS:
+        if pid_def.data_type is ObdVin:
+            continue
+        signal = scanner._obd_res.get_signal_by_name(pid_def.name)
+        decoder = scanner._build_decoder(pid_def.mode, pid_def.pid)
+        assert decoder is not None
+        for _ in range(200):
+            raw = rng.getrandbits(signal.length)
+            response = {
+                'length': pid_def.length,
+                'response': 4,
+                'service': pid_def.mode,
+                PID_MUX[pid_def.mode]: pid_def.pid,
+                pid_def.name: raw * signal.scale + signal.offset,
+            }
+            data = scanner._obd_res.encode(response)
+            expected = scanner._obd_res.decode(data, decode_choices=False)
+            assert decoder(data) == expected[pid_def.name]
+
+
+def test_restart_runs_one_scan_loop():
+    scanner = ObdScanner(scan_interval=0.01)
+    scans = []
+    
+    def get_pids_supported():
+        scanner._scan_pids = { 1: [0x0C] }
+    
+    def scan_once():
+        scans.append(threading.current_thread())
+        time.sleep(0.02)
+        return 1
+    
+    scanner._get_pids_supported = get_pids_supported
+    scanner._scan_once = scan_once
+    scanner.start()
+    with pytest.raises(RuntimeError):
+        scanner.start()
+    time.sleep(0.05)
+    scanner.stop()
+    assert not any(t.is_alive() for t in scans)
+    scanner.start()
+    time.sleep(0.05)
+    scanner.stop()
+    assert len(set(scans)) == 2
+    assert not any(t.is_alive() for t in scans)
+
+
+class _SendLog:
+    """Stand-in for a CANbus that records the messages sent."""
+    def __init__(self):
+        self.sent = []
+    
+    def send(self, message: can.Message, timeout: float = None):
+        self.sent.append(message)
+
+
+def test_flow_control_addressing():
+    scanner = CanScanner()
+    scanner.bus = _SendLog()
+    scanner._send_flow_control(0x7E8, False)
+    scanner._send_flow_control(0x18DAF110, True)
+    standard, extended = scanner.bus.sent
+    assert (standard.arbitration_id, standard.is_extended_id) == (0x7E0, False)
+    assert (extended.arbitration_id, extended.is_extended_id) == (0x18DA10F1,
+                                                                  True)
+    assert bytes(extended.data[:3]) == b'\x30\x00\x00'
+
+
+class _FlakyBus(_SendLog):
+    """Stand-in for a CANbus whose receive fails before delivering."""
+    def __init__(self, scanner: CanScanner, messages: 'list'):
+        super().__init__()
+        self.scanner = scanner
+        self.messages = messages
+    
+    def fileno(self) -> int:
+        raise NotImplementedError
+    
+    def recv(self, timeout: float = None) -> 'can.Message|None':
+        if not self.messages:
+            self.scanner.bus = None
+            return None
+        message = self.messages.pop(0)
+        if isinstance(message, Exception):
+            raise message
+        return message
+
+
+def test_rx_dispatch_survives_receive_errors(monkeypatch):
+    monkeypatch.setattr(can_scanner, 'RX_ERROR_BACKOFF', 0.001)
+    scanner = CanScanner()
+    response = can.Message(arbitration_id=0x7E8,
+                           is_extended_id=False,
+                           data=bytes.fromhex('03410d3200000000'))
+    scanner.bus = _FlakyBus(scanner, [
+        can.CanOperationError('Network is down'),
+        OSError('No such device'),
+        response,
+    ])
+    with scanner._pending_lock:
+        future = Future()
+        scanner._pending[(1, 0x0D)] = future
+    scanner._rx_dispatch()
+    assert future.result(timeout=0).value_raw == 50
+
+
+class _SlowEcu(_SendLog):
+    """Stand-in for a CANbus with an ECU answering all but one PID late."""
+    def __init__(self, scanner: CanScanner, silent_pid: int):
+        super().__init__()
+        self.scanner = scanner
+        self.silent_pid = silent_pid
+        self.max_pending = 0
+    
+    def send(self, message: can.Message, timeout: float = None):
+        super().send(message)
+        self.max_pending = max(self.max_pending, len(self.scanner._pending))
+        pid = message.data[2]
+        if pid != self.silent_pid:
+            threading.Timer(0.005, self.scanner._on_response,
+                            (1, pid, 0, time.time_ns())).start()
+
+
+@pytest.mark.parametrize('max_in_flight', [1, 2])
+def test_scan_once_limits_requests_in_flight(max_in_flight):
+    scanner = CanScanner(scan_interval=5, max_in_flight=max_in_flight)
+    scanner.bus = _SlowEcu(scanner, silent_pid=0x21)
+    scanner._scan_plan = [(1, 0x0C), (1, 0x0D), (1, 0x21), (1, 0x5C)]
+    started = time.monotonic()
+    assert scanner._scan_once() == 3
+    # the unanswered PID times out per request, not after scan_interval
+    assert time.monotonic() - started < 1
+    assert scanner.bus.max_pending == max_in_flight
+    assert len(scanner.bus.sent) == 4
+    assert not scanner._pending
+
+
+def test_sent_at_cleared_and_timeout_floor():
+    scanner = CanScanner()
+    scanner.bus = _SendLog()
+    scanner._rtt_ewma = 0.0001
+    assert scanner._query_timeout(0x0D) == pytest.approx(
+        can_scanner.MIN_RESPONSE_TIMEOUT * 3)
+    unanswered = scanner._send(0x0C)
+    scanner._discard(0x0C, 1, unanswered)
+    scanner.vin_message_count = 3
+    vin = scanner._send(2, 9)
+    scanner._resolve(9, 2, None)
+    assert vin.result(timeout=0) is None
+    assert not scanner._sent_at
+    assert not scanner._pending
+
+
+@pytest.mark.parametrize('vin_message_count', [0, 1])
+def test_vin_completes_from_first_frame_length(vin_message_count):
+    scanner = CanScanner()
+    scanner.bus = _SendLog()
+    scanner.vin_message_count = vin_message_count
+    assert scanner._query_timeout(2, 9) > 0
+    future = scanner._send(2, 9)
+    for data in ('1014490201314654', '2146573145465845', '2246423334343739'):
+        response = can.Message(arbitration_id=0x7E8,
+                               is_extended_id=False,
+                               data=bytes.fromhex(data))
+        scanner._dispatch(response, time.time_ns())
+    assert future.result(timeout=0).value == '1FTFW1EFXEFB34479'
+    flow_control = [m for m in scanner.bus.sent if m.data[0] == 0x30]
+    assert len(flow_control) == 1
@@ -0,0 +1,100 @@
+import random
+import time
+
+import can
+import pytest
+from cantools.database import EncodeError
+
+from obdsim import simulator as simulator_module
+from obdsim.obdsignal import PID_DEFINITIONS, PID_MUX, ObdVin
+from obdsim.simulator import ObdSimulator
+
+
+def _response(pid_def, value) -> dict:
+    return {
+        'length': pid_def.length,
+        'response': 4,
+        'service': pid_def.mode,
+        PID_MUX[pid_def.mode]: pid_def.pid,
+        pid_def.name: value,
+    }
+
+
+def test_direct_encoder_matches_cantools():
+    simulator = ObdSimulator()
+    rng = random.Random(0)
+    for pid_def in PID_DEFINITIONS:
+        if pid_def.data_type is ObdVin:
+            continue
+        signal = simulator._obd_res.get_signal_by_name(pid_def.name)
+        # first encode uses cantools and builds the direct encoder
+        simulator._encode(pid_def.mode, pid_def.pid,
+                          _response(pid_def, signal.minimum))
+        assert simulator._encoders[(pid_def.mode, pid_def.pid)] is not None
+        for _ in range(200):
+            value = rng.uniform(signal.minimum, signal.maximum)
+            if rng.random() < 0.5:
+                value = round(value / signal.scale) * signal.scale
+            value = min(max(value, signal.minimum), signal.maximum)
+            response = _response(pid_def, value)
+            expected = simulator._obd_res.encode(response)
+            assert simulator._encode(pid_def.mode, pid_def.pid,
+                                     response) == expected
+
+
+@pytest.mark.parametrize('name,value', [
+    ('VEHICLE_SPEED', 256),
+    ('VEHICLE_SPEED', 255.4),
+    ('OIL_TEMP', -41),
+    ('ENGINE_SPEED', 16384),
+])
+def test_direct_encoder_range(name, value):
+    simulator = ObdSimulator()
+    pid_def = next(d for d in PID_DEFINITIONS if d.name == name)
+    response = _response(pid_def, value)
+    with pytest.raises(EncodeError):
+        simulator._obd_res.encode(response)
+    simulator._encode(pid_def.mode, pid_def.pid, _response(pid_def, 0))
+    assert simulator._encoders[(pid_def.mode, pid_def.pid)] is not None
+    with pytest.raises(EncodeError):
+        simulator._encode(pid_def.mode, pid_def.pid, response)
+
+
+class _FlakyBus:
+    """Stand-in for a CANbus whose receive fails before delivering."""
+    def __init__(self, received: 'list'):
+        self.received = received
+        self.sent = []
+    
+    def fileno(self) -> int:
+        raise NotImplementedError
+    
+    def recv(self, timeout: float = None) -> 'can.Message|None':
+        if not self.received:
+            time.sleep(timeout or 0)
+            return None
+        message = self.received.pop(0)
+        if isinstance(message, Exception):
+            raise message
+        return message
+    
+    def send(self, message: can.Message, timeout: float = None):
+        self.sent.append(message)
+
+
+def test_listener_survives_receive_errors(monkeypatch):
+    monkeypatch.setattr(simulator_module, 'RX_ERROR_BACKOFF', 0.001)
+    simulator = ObdSimulator()
+    request = can.Message(arbitration_id=0x7DF,
+                          is_extended_id=False,
+                          data=bytes.fromhex('02010d0000000000'))
+    simulator._bus = _FlakyBus([can.CanOperationError('Network is down'),
+                                OSError('No such device'),
+                                request])
+    simulator._bus_ready.set()
+    simulator.start()
+    deadline = time.monotonic() + 2
+    while not simulator._bus.sent and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert simulator._listener.is_alive()
+    assert bytes(simulator._bus.sent[0].data[:3]) == bytes.fromhex('03410d')